@@ -1,13 +1,16 @@
 # app.py
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_from_directory, g
 import sqlite3
-from flask import Response
+from flask import Response, stream_with_context
 import csv
 import os
 import base64
 import datetime
 import io
+import mimetypes
 import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from PIL import Image
 import tempfile
 import shutil
@@ -21,6 +24,65 @@ except Exception as e:
     FACE_LIB_AVAILABLE = False
     print("face_recognition (or numpy) not available:", e)
 
+# low-level dlib handles for batched descriptor computation (optional)
+try:
+    import dlib
+    from face_recognition.api import face_encoder, pose_predictor_68_point
+    DLIB_BATCH_AVAILABLE = True
+except Exception as e:
+    DLIB_BATCH_AVAILABLE = False
+    print("dlib batched encoder not available:", e)
+
+# OpenCV for SIMD image decode + absdiff in the motion path (optional)
+try:
+    import cv2
+    CV2_AVAILABLE = True
+except Exception as e:
+    CV2_AVAILABLE = False
+    print("cv2 not available, using PIL for decode/motion:", e)
+
+# torch for int8 gallery matmul (optional; lowers to VNNI on AVX-512 CPUs)
+try:
+    import torch
+    TORCH_INT8_AVAILABLE = hasattr(torch, "_int_mm")
+except Exception as e:
+    TORCH_INT8_AVAILABLE = False
+    print("torch int8 matmul not available:", e)
+
+# numba for a fused, early-exiting motion kernel (optional)
+try:
+    from numba import njit
+
+    @njit(cache=True)
+    def motion_count_exceeds(a, b, diff_threshold, threshold_pixels):
+        # fused |a-b| > t count in one pass; bails out as soon as the
+        # pixel budget is exceeded instead of scanning the whole frame
+        cnt = 0
+        af = a.ravel()
+        bf = b.ravel()
+        for i in range(af.size):
+            d = int(af[i]) - int(bf[i])
+            if d < 0:
+                d = -d
+            if d > diff_threshold:
+                cnt += 1
+                if cnt > threshold_pixels:
+                    return True
+        return False
+
+    NUMBA_AVAILABLE = True
+except Exception as e:
+    NUMBA_AVAILABLE = False
+    print("numba not available, motion uses vectorized path:", e)
+
+# faiss for sub-linear nearest-neighbor search over large galleries (optional)
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except Exception as e:
+    FAISS_AVAILABLE = False
+    print("faiss not available, using dense matmul search:", e)
+
 # --- Paths & Flask app ---
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 PHOTO_DIR = os.path.join(BASE_DIR, "static", "photos")
@@ -32,9 +94,123 @@ os.makedirs(DB_DIR, exist_ok=True)
 
 app = Flask(__name__, template_folder="templates", static_folder="static")
 
-# cache of encodings: {abs_path: np.array}
-ENCODING_CACHE = {}
-ENCODING_CACHE_LOCK = threading.Lock()
+# production offload for photo serving: USE_X_SENDFILE=1 lets the WSGI server
+# send file bytes via sendfile(2); PHOTO_ACCEL_PREFIX=/_protected_photos makes
+# /photos/<f> answer with an X-Accel-Redirect so NGINX (internal location
+# aliased to static/photos/) serves the file without touching Python
+app.config["USE_X_SENDFILE"] = os.environ.get("USE_X_SENDFILE") == "1"
+PHOTO_ACCEL_PREFIX = os.environ.get("PHOTO_ACCEL_PREFIX")
+
+# pool for base64 + image decoding; libjpeg/libpng and b64decode release the GIL
+DECODE_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 2)
+
+# single-worker queue for enrollment encoding: bulk uploads line up behind one
+# warm dlib context instead of each spawning a fresh thread + CNN invocation
+ENC_POOL = ThreadPoolExecutor(max_workers=1)
+
+# orjson-backed JSON provider (optional): parsing the large base64 frame
+# payloads dominates request CPU before face work even starts
+try:
+    import orjson
+    from flask.json.provider import JSONProvider
+
+    class OrjsonProvider(JSONProvider):
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj)
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+    app.json = OrjsonProvider(app)
+except Exception as e:
+    print("orjson not available, using stdlib json:", e)
+
+# in-memory gallery loaded from photo_encodings table:
+# KNOWN_MATRIX is a (N,128) float32 matrix, KNOWN_META the parallel [(photo_id, student_id, photo_path)]
+KNOWN_MATRIX = None   # rows are L2-normalized, so matching is a pure dot product
+KNOWN_Q = None        # int8-quantized gallery (torch tensor) when torch is present
+KNOWN_SCALE = None    # per-row dequantization scales for KNOWN_Q
+KNOWN_INDEX = None    # faiss L2 index over KNOWN_MATRIX when faiss is present
+KNOWN_META = []
+KNOWN_LOCK = threading.Lock()
+
+# above this gallery size, partition the faiss index (IVF) for log-scale search
+FAISS_IVF_MIN = 5000
+# partitions visited per query; faiss defaults to 1, which tanks recall@1
+FAISS_NPROBE = 16
+
+# students already marked present today; concurrent clients shooting the same
+# scene dedupe on this set instead of each inserting its own attendance row
+MARKED_TODAY = set()
+MARKED_TODAY_DATE = None
+MARKED_TODAY_LOCK = threading.Lock()
+
+def already_marked_today(student_id, date_str):
+    """
+    True if student_id was already marked present on date_str; otherwise
+    records it and returns False. The set resets when the date rolls over.
+    """
+    global MARKED_TODAY_DATE
+    with MARKED_TODAY_LOCK:
+        if MARKED_TODAY_DATE != date_str:
+            MARKED_TODAY.clear()
+            MARKED_TODAY_DATE = date_str
+        if student_id in MARKED_TODAY:
+            return True
+        MARKED_TODAY.add(student_id)
+        return False
+
+def normalize_rows(M):
+    """
+    L2-normalize matrix rows (zero rows are left untouched).
+    """
+    norms = np.linalg.norm(M, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return M / norms
+
+def build_faiss_index(K):
+    """
+    Inner-product faiss index over the (normalized) gallery; IVF-partitioned
+    once the gallery is large enough that the linear scan dominates.
+    """
+    n = K.shape[0]
+    if n > FAISS_IVF_MIN:
+        nlist = int(n ** 0.5)
+        index = faiss.IndexIVFFlat(faiss.IndexFlatIP(128), 128, nlist,
+                                   faiss.METRIC_INNER_PRODUCT)
+        index.train(K)
+        index.nprobe = FAISS_NPROBE
+    else:
+        index = faiss.IndexFlatIP(128)
+    index.add(K)
+    return index
+
+def quantize_rows(M):
+    """
+    Symmetric per-row int8 quantization: returns (Mq int8, scale float32)
+    with M ~= Mq * scale[:, None].
+    """
+    amax = np.abs(M).max(1)
+    amax[amax == 0] = 1.0
+    scale = (amax / 127.0).astype(np.float32)
+    Mq = np.round(M / scale[:, None]).astype(np.int8)
+    return Mq, scale
+
+def gallery_dot(known_matrix, known_q, known_scale, U):
+    """
+    Dot products of every gallery row against every unknown encoding,
+    i.e. K @ U.T. Uses torch's int8 matmul (VNNI VPDPBUSD on AVX-512)
+    when available; quantization error (<1e-3 per component) is far
+    below the 0.5 match threshold. Falls back to fp32 BLAS GEMM.
+    """
+    if known_q is not None:
+        try:
+            Uq, u_scale = quantize_rows(U)
+            S = torch._int_mm(known_q, torch.from_numpy(Uq).t().contiguous())
+            return S.numpy().astype(np.float32) * known_scale[:, None] * u_scale[None, :]
+        except Exception as e:
+            print("int8 matmul failed, falling back to fp32:", e)
+    return known_matrix @ U.T
 
 # -----------------------
 # Database initialization
@@ -85,14 +261,68 @@ def init_db():
         )
     """)
 
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS photo_encodings (
+            photo_id INTEGER PRIMARY KEY,
+            student_id INTEGER,
+            enc BLOB,
+            FOREIGN KEY(photo_id) REFERENCES photos(id)
+        )
+    """)
+
+    # lookup indexes: photos by student / filename, attendance by day
+    c.execute("CREATE INDEX IF NOT EXISTS idx_photos_sid ON photos(student_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_photos_filename ON photos(filename)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_attendance_date ON attendance(date, time_in DESC)")
+
+    # WAL persists in the db file: concurrent readers + fewer fsyncs
+    c.execute("PRAGMA journal_mode=WAL")
+
     conn.commit()
     conn.close()
 
 init_db()
 
+def get_db():
+    """
+    Request-scoped sqlite connection (one per app context, closed on teardown)
+    so handlers stop paying connect/journal-init overhead per query.
+    """
+    if "db" not in g:
+        g.db = sqlite3.connect(DB_PATH)
+        g.db.execute("PRAGMA synchronous=NORMAL")
+        g.db.execute("PRAGMA temp_store=MEMORY")
+        g.db.execute("PRAGMA mmap_size=268435456")
+    return g.db
+
+@app.teardown_appcontext
+def close_db(exc):
+    db = g.pop("db", None)
+    if db is not None:
+        db.close()
+
 # -----------------------
 # Helpers
 # -----------------------
+# per-thread reusable buffer for PIL decoding: avoids churning a fresh
+# BytesIO per frame (works from the DECODE_POOL workers too)
+_DECODE_BUF = threading.local()
+
+def open_image_bytes(img_bytes):
+    """
+    PIL-open raw image bytes through a reusable per-thread BytesIO.
+    Callers must consume the image immediately (e.g. .convert(...)) since
+    the buffer is recycled by the next decode on the same thread.
+    """
+    buf = getattr(_DECODE_BUF, "buf", None)
+    if buf is None:
+        buf = _DECODE_BUF.buf = io.BytesIO()
+    buf.seek(0)
+    buf.truncate()
+    buf.write(img_bytes)
+    buf.seek(0)
+    return Image.open(buf)
+
 def save_base64_image(base64_data, filename):
     """
     Save base64 / dataURL to static/photos/filename and return absolute path.
@@ -105,36 +335,249 @@ def save_base64_image(base64_data, filename):
         f.write(img_bytes)
     return path
 
+def save_file_image(file_storage, filename):
+    """
+    Save an uploaded image file straight to static/photos/filename (no base64
+    round-trip) and return absolute path.
+    """
+    path = os.path.join(PHOTO_DIR, filename)
+    with open(path, "wb") as f:
+        shutil.copyfileobj(file_storage.stream, f)
+    return path
+
+@lru_cache(maxsize=4096)
+def _face_encoding_cached(path):
+    """
+    Cacheable core of compute_face_encoding_from_file: returns the encoding
+    or raises. lru_cache never memoizes a raising call, so only successes
+    are cached and a transient failure is retried on the next lookup.
+    """
+    sidecar = path + ".enc.f16"
+    try:
+        if os.path.exists(sidecar):
+            with open(sidecar, "rb") as f:
+                return np.frombuffer(f.read(), dtype=np.float16).astype(np.float32)
+    except Exception as e:
+        print("Sidecar read error for", sidecar, ":", e)
+    img = face_recognition.load_image_file(path)
+    encs = face_recognition.face_encodings(img)
+    if not encs:
+        raise ValueError("no face found")
+    enc = encs[0]
+    try:
+        # atomic write so a crash never leaves a truncated sidecar
+        fd, tmp = tempfile.mkstemp(dir=PHOTO_DIR)
+        with os.fdopen(fd, "wb") as f:
+            f.write(enc.astype(np.float16).tobytes())
+        os.replace(tmp, sidecar)
+    except Exception as e:
+        print("Sidecar write error for", sidecar, ":", e)
+    return enc
+
 def compute_face_encoding_from_file(path):
     """
     Return a 1-d numpy array encoding or None.
-    Uses in-memory cache to speed repeated lookups.
+    Successes are memoized in a bounded, thread-safe LRU keyed on path and
+    persisted to an fp16 sidecar file next to the image so restarts skip
+    dlib inference (fp16 error is far below the 0.5 match threshold).
     """
     if not FACE_LIB_AVAILABLE:
         return None
-    with ENCODING_CACHE_LOCK:
-        if path in ENCODING_CACHE:
-            return ENCODING_CACHE[path]
     try:
-        img = face_recognition.load_image_file(path)
-        encs = face_recognition.face_encodings(img)
-        if encs:
-            enc = encs[0]
-            with ENCODING_CACHE_LOCK:
-                ENCODING_CACHE[path] = enc
-            return enc
+        return _face_encoding_cached(path)
     except Exception as e:
         print("Encoding error for", path, ":", e)
-    return None
+        return None
+
+def load_known_encodings():
+    """
+    Load every stored encoding from photo_encodings into the module-level
+    gallery: KNOWN_MATRIX (N,128 float32) + KNOWN_META [(photo_id, student_id, photo_path)].
+    Called at startup and after any enrollment change.
+    """
+    global KNOWN_MATRIX, KNOWN_Q, KNOWN_SCALE, KNOWN_INDEX, KNOWN_META
+    if not FACE_LIB_AVAILABLE:
+        return
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute("""
+        SELECT e.photo_id, e.student_id, p.photo_path, e.enc
+        FROM photo_encodings e JOIN photos p ON e.photo_id = p.id
+    """)
+    rows = c.fetchall()
+    conn.close()
+
+    encs = []
+    meta = []
+    for pid, sid, ppath, blob in rows:
+        if blob is None:
+            continue
+        encs.append(np.frombuffer(blob, dtype=np.float32))
+        meta.append((pid, sid, ppath))
+    with KNOWN_LOCK:
+        if encs:
+            # normalized rows make L2 distance equivalent to 2 - 2*cos,
+            # so matching needs only the dot products
+            KNOWN_MATRIX = normalize_rows(np.vstack(encs).reshape(-1, 128))
+            if TORCH_INT8_AVAILABLE:
+                Kq, KNOWN_SCALE = quantize_rows(KNOWN_MATRIX)
+                KNOWN_Q = torch.from_numpy(Kq)
+            else:
+                KNOWN_Q = None
+                KNOWN_SCALE = None
+            KNOWN_INDEX = build_faiss_index(KNOWN_MATRIX) if FAISS_AVAILABLE else None
+        else:
+            KNOWN_MATRIX = None
+            KNOWN_Q = None
+            KNOWN_SCALE = None
+            KNOWN_INDEX = None
+        KNOWN_META = meta
+
+def store_photo_encoding(photo_id, student_id, path):
+    """
+    Compute the encoding for a freshly saved photo, persist it in
+    photo_encodings and refresh the in-memory gallery.
+    Safe to run in a background thread.
+    """
+    enc = compute_face_encoding_from_file(path)
+    if enc is None:
+        # still refresh: replace_photo deletes the old rows before this runs,
+        # so the in-memory gallery must drop them even if the new photo
+        # failed to encode
+        load_known_encodings()
+        return
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute("INSERT OR REPLACE INTO photo_encodings (photo_id, student_id, enc) VALUES (?, ?, ?)",
+              (photo_id, student_id, enc.astype(np.float32).tobytes()))
+    conn.commit()
+    conn.close()
+    load_known_encodings()
+
+def backfill_photo_encodings():
+    """
+    Queue encoding for photos that predate the photo_encodings table so an
+    upgraded deployment keeps matching without re-uploading every photo.
+    """
+    if not FACE_LIB_AVAILABLE:
+        return
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute("""
+        SELECT p.id, p.student_id, p.photo_path
+        FROM photos p LEFT JOIN photo_encodings e ON e.photo_id = p.id
+        WHERE e.photo_id IS NULL
+    """)
+    rows = c.fetchall()
+    conn.close()
+    for pid, sid, ppath in rows:
+        ENC_POOL.submit(store_photo_encoding, pid, sid, ppath)
+
+# preload the gallery once at import time, then encode any photos that
+# don't have a stored encoding yet in the background
+load_known_encodings()
+backfill_photo_encodings()
+
+# width used for downscaled face detection; detection cost scales with pixel count
+DETECT_WIDTH = 320
 
 def compute_face_encodings_from_pil(pil_img):
     """
     Given PIL.Image, return list of encodings found (may be empty).
+    Detection runs on a downscaled copy (locations are scaled back up);
+    uses dlib's batched compute_face_descriptor when available so all faces
+    in the image are encoded in a single call instead of one-by-one.
     """
     if not FACE_LIB_AVAILABLE:
         return []
-    arr = np.array(pil_img.convert("RGB"))
-    return face_recognition.face_encodings(arr)
+    rgb = pil_img.convert("RGB")
+    arr = np.array(rgb)
+
+    # detect on a small copy, encode at full resolution
+    if rgb.width > DETECT_WIDTH:
+        scale = rgb.width / float(DETECT_WIDTH)
+        small = rgb.resize((DETECT_WIDTH, max(1, int(rgb.height / scale))), Image.BILINEAR)
+        locations = face_recognition.face_locations(np.array(small), number_of_times_to_upsample=0)
+        locations = [(int(t * scale), int(r * scale), int(b * scale), int(l * scale))
+                     for (t, r, b, l) in locations]
+    else:
+        locations = face_recognition.face_locations(arr)
+
+    if not locations:
+        return []
+    if not DLIB_BATCH_AVAILABLE:
+        return face_recognition.face_encodings(arr, known_face_locations=locations)
+    try:
+        # css tuples are (top, right, bottom, left); dlib wants (left, top, right, bottom)
+        dets = [pose_predictor_68_point(arr, dlib.rectangle(l, t, r, b))
+                for (t, r, b, l) in locations]
+        # single-image multi-face overload: wants a full_object_detections
+        # container and returns one flat descriptor per face
+        descriptors = face_encoder.compute_face_descriptor(
+            arr, dlib.full_object_detections(dets), 1)
+        return [np.array(d) for d in descriptors]
+    except Exception as e:
+        print("dlib multi-face encode failed, using face_encodings:", e)
+        return face_recognition.face_encodings(arr, known_face_locations=locations)
+
+def cuda_batch_detect_available():
+    """
+    True when dlib was built with CUDA, i.e. batch_face_locations actually
+    runs the CNN detector batched on GPU instead of per-frame on CPU.
+    """
+    return DLIB_BATCH_AVAILABLE and getattr(dlib, "DLIB_USE_CUDA", False)
+
+def box_iou(a, b):
+    """
+    Intersection-over-union of two css boxes (top, right, bottom, left).
+    """
+    it, ir = max(a[0], b[0]), min(a[1], b[1])
+    ib, il = min(a[2], b[2]), max(a[3], b[3])
+    if ir <= il or ib <= it:
+        return 0.0
+    inter = (ir - il) * (ib - it)
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    return inter / float(area_a + area_b - inter)
+
+def compute_face_encodings_from_frames(pil_imgs):
+    """
+    Encode faces across several frames of the same scene. With CUDA dlib,
+    detection runs batched over all frames in one call; detections are
+    unioned across frames and deduped by IoU (same face sits in roughly the
+    same spot between frames), then all surviving crops are encoded in one
+    batched descriptor call. Without CUDA, falls back to the middle frame.
+    """
+    if not FACE_LIB_AVAILABLE or not pil_imgs:
+        return []
+    mid = pil_imgs[len(pil_imgs) // 2]
+    if len(pil_imgs) < 2 or not cuda_batch_detect_available():
+        return compute_face_encodings_from_pil(mid)
+    try:
+        arrs = [np.array(im.convert("RGB")) for im in pil_imgs]
+        batched = face_recognition.batch_face_locations(
+            arrs, number_of_times_to_upsample=0, batch_size=len(arrs))
+        seen = []
+        imgs = []
+        dets = []
+        for fi, locs in enumerate(batched):
+            for css in locs:
+                if any(box_iou(css, s) > 0.5 for s in seen):
+                    continue
+                seen.append(css)
+                t, r, b, l = css
+                imgs.append(arrs[fi])
+                dets.append(pose_predictor_68_point(arrs[fi], dlib.rectangle(l, t, r, b)))
+        if not dets:
+            return []
+        # batched overload wants one full_object_detections container per
+        # image and returns nested per-image results (one descriptor each)
+        batch_faces = [dlib.full_object_detections([d]) for d in dets]
+        descriptors = face_encoder.compute_face_descriptor(imgs, batch_faces, 1)
+        return [np.array(dv[0]) for dv in descriptors]
+    except Exception as e:
+        print("batched frame detection failed, using middle frame:", e)
+        return compute_face_encodings_from_pil(mid)
 
 def filename_exists_in_db(conn, filename):
     c = conn.cursor()
@@ -151,14 +594,87 @@ def student_has_photo(conn, student_id):
 # -----------------------
 # Motion-based liveness check (Option C)
 # -----------------------
-def frames_have_motion(frames_b64_list, threshold_pixels=1000, diff_threshold=30):
+def decode_gray_frame(img_bytes, downscale=4):
+    """
+    Decode raw image bytes to a downscaled grayscale array for the motion check.
+    Prefers cv2.imdecode (returns a numpy array directly, SIMD codecs) over the
+    PIL decode + np.array copy.
+    """
+    if CV2_AVAILABLE:
+        gray = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            raise ValueError("cv2 could not decode frame")
+        if downscale > 1:
+            h, w = gray.shape
+            gray = cv2.resize(gray, (max(1, w // downscale), max(1, h // downscale)),
+                              interpolation=cv2.INTER_AREA)
+        return gray
+    im = open_image_bytes(img_bytes).convert("L")  # grayscale
+    if downscale > 1:
+        im = im.resize((max(1, im.width // downscale), max(1, im.height // downscale)),
+                       Image.BILINEAR)
+    return np.array(im)
+
+def gray_frames_have_motion(gray_frames, threshold_pixels=1000, diff_threshold=30, downscale=4):
+    """
+    Core motion check on decoded grayscale frames: compute the absolute diff
+    between consecutive frames and count pixels above diff_threshold. If
+    **any** consecutive pair has count above the (area-scaled)
+    threshold_pixels -> treat as motion (live).
+    """
+    # threshold was tuned for full-resolution frames; scale by the area ratio
+    if downscale > 1:
+        threshold_pixels = max(1, threshold_pixels // (downscale * downscale))
+
+    # fused numba kernel: single pass per pair, early exit on the first
+    # motion-positive pair
+    if NUMBA_AVAILABLE:
+        try:
+            for i in range(len(gray_frames) - 1):
+                if gray_frames[i].shape != gray_frames[i + 1].shape:
+                    # mismatched frame sizes - cannot judge motion
+                    return False
+                if motion_count_exceeds(gray_frames[i], gray_frames[i + 1],
+                                        diff_threshold, threshold_pixels):
+                    return True
+            return False
+        except Exception as e:
+            print("numba motion kernel failed, falling back:", e)
+
+    # cv2.absdiff/threshold/countNonZero stay in uint8 with SSE/AVX kernels
+    if CV2_AVAILABLE:
+        try:
+            for i in range(len(gray_frames) - 1):
+                diff = cv2.absdiff(gray_frames[i], gray_frames[i + 1])
+                _, mask = cv2.threshold(diff, diff_threshold, 255, cv2.THRESH_BINARY)
+                if cv2.countNonZero(mask) > threshold_pixels:
+                    return True
+        except cv2.error:
+            # mismatched frame sizes - cannot judge motion
+            return False
+        return False
+
+    # stack into one (n, H, W) tensor and diff all consecutive pairs in a
+    # single vectorized op instead of a Python loop per pair
+    try:
+        F = np.stack(gray_frames)
+    except ValueError:
+        # mismatched frame sizes - cannot judge motion
+        return False
+    # |a-b| without leaving uint8: max(a,b) - min(a,b) never underflows
+    # (numpy's uint8 subtract wraps rather than saturates), so the whole
+    # pipeline touches half the bytes of the old int16 promotion
+    a, b = F[1:], F[:-1]
+    diff = np.maximum(a, b) - np.minimum(a, b)
+    counts = (diff > diff_threshold).reshape(len(gray_frames) - 1, -1).sum(1)
+    return bool((counts > threshold_pixels).any())
+
+def frames_have_motion(frames_b64_list, threshold_pixels=1000, diff_threshold=30, downscale=4):
     """
-    Simple server-side motion check:
-    - frames_b64_list: list of dataURLs or base64 strings (len >= 2 recommended)
-    - Convert to grayscale, compute absolute difference between consecutive frames,
-      count number of pixels with diff > diff_threshold. If **any** consecutive pair
-      has count > threshold_pixels -> treat as motion (live).
-    Returns True if motion detected, False otherwise.
+    Simple server-side motion check on base64 / dataURL frames
+    (len >= 2 recommended). Frames are downscaled by `downscale` per axis
+    (motion decisions are unchanged at lower resolution but the diff touches
+    1/16 the pixels). Returns True if motion detected, False otherwise.
 
     NOTE: This is a heuristic fallback — client should send 2-4 frames captured a short time apart.
     """
@@ -166,26 +682,18 @@ def frames_have_motion(frames_b64_list, threshold_pixels=1000, diff_threshold=30
         # Not enough frames to judge motion
         return False
 
-    gray_frames = []
-    for b64 in frames_b64_list:
+    def decode_gray(b64):
         if "," in b64:
             b64 = b64.split(",", 1)[1]
-        try:
-            im = Image.open(io.BytesIO(base64.b64decode(b64))).convert("L")  # grayscale
-            arr = np.array(im)
-            gray_frames.append(arr)
-        except Exception:
-            return False
+        return decode_gray_frame(base64.b64decode(b64), downscale)
 
-    for i in range(len(gray_frames)-1):
-        a = gray_frames[i].astype("int16")
-        b = gray_frames[i+1].astype("int16")
-        diff = np.abs(a - b)
-        # count pixels above threshold
-        cnt = int((diff > diff_threshold).sum())
-        if cnt > threshold_pixels:
-            return True
-    return False
+    # decode frames in parallel; base64 + image codecs release the GIL
+    try:
+        gray_frames = list(DECODE_POOL.map(decode_gray, frames_b64_list))
+    except Exception:
+        return False
+
+    return gray_frames_have_motion(gray_frames, threshold_pixels, diff_threshold, downscale)
 
 # -----------------------
 # Page routes
@@ -204,7 +712,17 @@ def attendance_page():
 
 @app.route("/photos/<path:filename>")
 def photos(filename):
-    return send_from_directory(PHOTO_DIR, filename)
+    if PHOTO_ACCEL_PREFIX:
+        # only plain filenames may reach the redirect header: a ../ segment
+        # would walk nginx out of the internal photos location
+        if filename != os.path.basename(filename) or ".." in filename:
+            return Response(status=404)
+        # empty-body response; NGINX picks up the header and sends the file
+        resp = Response(mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream")
+        resp.headers["X-Accel-Redirect"] = f"{PHOTO_ACCEL_PREFIX}/{filename}"
+        return resp
+    # conditional=True enables 304 responses for repeat fetches in dev
+    return send_from_directory(PHOTO_DIR, filename, conditional=True)
 
 # -----------------------
 # API: Students & Photos
@@ -232,7 +750,7 @@ def api_add_student():
         data.get("guardian_phone")
     )
 
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     c = conn.cursor()
     try:
         c.execute("""
@@ -243,9 +761,7 @@ def api_add_student():
         student_id = c.lastrowid
         conn.commit()
     except sqlite3.IntegrityError:
-        conn.close()
         return jsonify({"success": False, "message": "roll_no already exists"}), 409
-    conn.close()
     return jsonify({"success": True, "student_id": student_id})
 
 @app.route("/api/add_student_with_photo", methods=["POST"])
@@ -272,7 +788,7 @@ def api_add_student_with_photo():
     if not name or not roll:
         return jsonify({"success": False, "message": "name and roll_no required"}), 400
 
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     c = conn.cursor()
 
     # check if roll exists
@@ -283,30 +799,26 @@ def api_add_student_with_photo():
         # if student already has photo => reject
         c.execute("SELECT COUNT(*) FROM photos WHERE student_id=?", (student_id,))
         if (c.fetchone()[0] or 0) > 0:
-            conn.close()
             return jsonify({"success": False, "message": "Student already has a photo - upload refused"}), 409
         # attach photo to existing student
         if not photo_b64:
-            conn.close()
             return jsonify({"success": False, "message": "No photo provided to attach"}), 400
         safe_filename = f"{roll}.png"
         fs_path = os.path.join(PHOTO_DIR, safe_filename)
         if os.path.exists(fs_path) or filename_exists_in_db(conn, safe_filename):
-            conn.close()
             return jsonify({"success": False, "message": "Filename collision - upload refused"}), 409
         try:
             saved = save_base64_image(photo_b64, safe_filename)
             created_at = datetime.datetime.now().isoformat()
             c.execute("INSERT INTO photos (student_id, photo_path, filename, created_at) VALUES (?, ?, ?, ?)",
                       (student_id, saved, safe_filename, created_at))
+            photo_id = c.lastrowid
             conn.commit()
-            # warm encoding cache
+            # compute + persist encoding in background
             if FACE_LIB_AVAILABLE:
-                threading.Thread(target=compute_face_encoding_from_file, args=(saved,)).start()
-            conn.close()
+                ENC_POOL.submit(store_photo_encoding, photo_id, student_id, saved)
             return jsonify({"success": True, "student_id": student_id, "photo_url": f"/photos/{safe_filename}", "message": "Photo attached"}), 201
         except Exception as e:
-            conn.close()
             return jsonify({"success": False, "message": f"Error saving photo: {e}"}), 500
 
     # create new student
@@ -333,7 +845,6 @@ def api_add_student_with_photo():
         student_id = c.lastrowid
         conn.commit()
     except sqlite3.IntegrityError:
-        conn.close()
         return jsonify({"success": False, "message": "roll_no conflict"}), 409
 
     photo_saved = False
@@ -343,21 +854,20 @@ def api_add_student_with_photo():
         fs_path = os.path.join(PHOTO_DIR, safe_filename)
         if os.path.exists(fs_path) or filename_exists_in_db(conn, safe_filename):
             # we leave the student row but inform user
-            conn.close()
             return jsonify({"success": True, "student_id": student_id, "message": "Student created but photo filename exists - attach later"}), 201
         try:
             saved = save_base64_image(photo_b64, safe_filename)
             created_at = datetime.datetime.now().isoformat()
             c.execute("INSERT INTO photos (student_id, photo_path, filename, created_at) VALUES (?, ?, ?, ?)",
                       (student_id, saved, safe_filename, created_at))
+            photo_id = c.lastrowid
             conn.commit()
             photo_saved = True
             if FACE_LIB_AVAILABLE:
-                threading.Thread(target=compute_face_encoding_from_file, args=(saved,)).start()
+                ENC_POOL.submit(store_photo_encoding, photo_id, student_id, saved)
         except Exception as e:
             print("photo save error:", e)
 
-    conn.close()
     return jsonify({"success": True, "student_id": student_id, "photo_url": (f"/photos/{safe_filename}" if photo_saved else None), "message": "Student created"}), 201
 
 @app.route("/api/upload_photo", methods=["POST"])
@@ -366,47 +876,45 @@ def api_upload_photo():
     Upload an extra photo for an existing student.
     Option: reject if student already has any photo (Option A).
     Request JSON: { "student_id": 12, "photo": "<dataURL>" }
+    or multipart/form-data with a "photo" file + "student_id" field (no base64).
     """
-    data = request.get_json() or {}
+    photo_file = request.files.get("photo")
+    data = request.form if photo_file else (request.get_json() or {})
     student_id = data.get("student_id")
     photo_b64 = data.get("photo")
-    if not student_id or not photo_b64:
+    if not student_id or not (photo_b64 or photo_file):
         return jsonify({"success": False, "message": "student_id and photo required"}), 400
 
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     c = conn.cursor()
     c.execute("SELECT roll_no FROM students WHERE student_id=?", (student_id,))
     r = c.fetchone()
     if not r:
-        conn.close()
         return jsonify({"success": False, "message": "student_id not found"}), 404
     roll = r[0] or str(student_id)
 
     # Option A: reject if student already has ANY photo
     c.execute("SELECT COUNT(*) FROM photos WHERE student_id=?", (student_id,))
     if (c.fetchone()[0] or 0) > 0:
-        conn.close()
         return jsonify({"success": False, "message": "Student already has a photo - upload refused"}), 409
 
     ts = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
     filename = f"{student_id}_{ts}.png"
     fs_path = os.path.join(PHOTO_DIR, filename)
     if os.path.exists(fs_path) or filename_exists_in_db(conn, filename):
-        conn.close()
         return jsonify({"success": False, "message": "filename collision"}), 500
 
     try:
-        saved = save_base64_image(photo_b64, filename)
+        saved = save_file_image(photo_file, filename) if photo_file else save_base64_image(photo_b64, filename)
         created_at = datetime.datetime.now().isoformat()
         c.execute("INSERT INTO photos (student_id, photo_path, filename, created_at) VALUES (?, ?, ?, ?)",
                   (student_id, saved, filename, created_at))
+        photo_id = c.lastrowid
         conn.commit()
         if FACE_LIB_AVAILABLE:
-            threading.Thread(target=compute_face_encoding_from_file, args=(saved,)).start()
-        conn.close()
+            ENC_POOL.submit(store_photo_encoding, photo_id, student_id, saved)
         return jsonify({"success": True, "photo_url": f"/photos/{filename}", "message": "Photo uploaded"}), 201
     except Exception as e:
-        conn.close()
         return jsonify({"success": False, "message": f"Error saving photo: {e}"}), 500
 
 @app.route("/api/replace_photo", methods=["POST"])
@@ -414,19 +922,20 @@ def api_replace_photo():
     """
     Replace existing photos for a student with provided photo.
     Request JSON: { "student_id": 12, "photo": "<dataURL>" }
+    or multipart/form-data with a "photo" file + "student_id" field (no base64).
     """
-    data = request.get_json() or {}
+    photo_file = request.files.get("photo")
+    data = request.form if photo_file else (request.get_json() or {})
     student_id = data.get("student_id")
     photo_b64 = data.get("photo")
-    if not student_id or not photo_b64:
+    if not student_id or not (photo_b64 or photo_file):
         return jsonify({"success": False, "message": "student_id and photo required"}), 400
 
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     c = conn.cursor()
     c.execute("SELECT roll_no FROM students WHERE student_id=?", (student_id,))
     r = c.fetchone()
     if not r:
-        conn.close()
         return jsonify({"success": False, "message": "student_id not found"}), 404
 
     # delete existing files & rows
@@ -436,39 +945,47 @@ def api_replace_photo():
         try:
             if p and os.path.exists(p):
                 os.remove(p)
+            if p and os.path.exists(p + ".enc.f16"):
+                os.remove(p + ".enc.f16")
         except Exception:
             pass
+    c.execute("DELETE FROM photo_encodings WHERE student_id=?", (student_id,))
     c.execute("DELETE FROM photos WHERE student_id=?", (student_id,))
     conn.commit()
 
     ts = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
     filename = f"{student_id}_{ts}.png"
     try:
-        saved = save_base64_image(photo_b64, filename)
+        saved = save_file_image(photo_file, filename) if photo_file else save_base64_image(photo_b64, filename)
         created_at = datetime.datetime.now().isoformat()
         c.execute("INSERT INTO photos (student_id, photo_path, filename, created_at) VALUES (?, ?, ?, ?)",
                   (student_id, saved, filename, created_at))
+        photo_id = c.lastrowid
         conn.commit()
         if FACE_LIB_AVAILABLE:
-            threading.Thread(target=compute_face_encoding_from_file, args=(saved,)).start()
-        conn.close()
+            ENC_POOL.submit(store_photo_encoding, photo_id, student_id, saved)
         return jsonify({"success": True, "photo_url": f"/photos/{filename}", "message": "Photo replaced"}), 200
     except Exception as e:
-        conn.close()
         return jsonify({"success": False, "message": f"Error saving replacement photo: {e}"}), 500
 
 @app.route("/api/get_students", methods=["GET"])
 def api_get_students():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     c = conn.cursor()
-    c.execute("SELECT * FROM students ORDER BY student_id DESC")
+    # one query: each student's first photo via MIN(p.id) instead of a
+    # per-student lookup (bare p.filename comes from the MIN row in sqlite)
+    c.execute("""
+        SELECT s.*, MIN(p.id), p.filename
+        FROM students s
+        LEFT JOIN photos p ON p.student_id = s.student_id
+        GROUP BY s.student_id
+        ORDER BY s.student_id DESC
+    """)
     rows = c.fetchall()
     students = []
     for row in rows:
         sid = row[0]
-        c.execute("SELECT filename FROM photos WHERE student_id=? ORDER BY id LIMIT 1", (sid,))
-        p = c.fetchone()
-        photo_url = f"/photos/{p[0]}" if p and p[0] else None
+        photo_url = f"/photos/{row[15]}" if row[15] else None
         students.append({
             "student_id": sid,
             "roll_no": row[1],
@@ -486,13 +1003,12 @@ def api_get_students():
             "guardian_phone": row[13],
             "photo_path": photo_url
         })
-    conn.close()
     return jsonify(students)
 
 @app.route("/api/update_student/<int:student_id>", methods=["PUT"])
 def api_update_student(student_id):
     data = request.get_json() or {}
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     c = conn.cursor()
     try:
         c.execute("""
@@ -517,14 +1033,12 @@ def api_update_student(student_id):
         ))
         conn.commit()
     except sqlite3.IntegrityError:
-        conn.close()
         return jsonify({"success": False, "message": "roll_no conflict"}), 409
-    conn.close()
     return jsonify({"success": True, "message": "Student updated"})
 
 @app.route("/api/delete_student/<int:student_id>", methods=["DELETE"])
 def api_delete_student(student_id):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     c = conn.cursor()
     c.execute("SELECT photo_path FROM photos WHERE student_id=?", (student_id,))
     rows = c.fetchall()
@@ -532,19 +1046,21 @@ def api_delete_student(student_id):
         try:
             if path and os.path.exists(path):
                 os.remove(path)
+            if path and os.path.exists(path + ".enc.f16"):
+                os.remove(path + ".enc.f16")
         except Exception:
             pass
+    c.execute("DELETE FROM photo_encodings WHERE student_id=?", (student_id,))
     c.execute("DELETE FROM photos WHERE student_id=?", (student_id,))
     c.execute("DELETE FROM attendance WHERE student_id=?", (student_id,))
     c.execute("DELETE FROM students WHERE student_id=?", (student_id,))
     conn.commit()
-    conn.close()
 
-    # clear encoding cache
-    with ENCODING_CACHE_LOCK:
-        for k in list(ENCODING_CACHE.keys()):
-            if f"{os.sep}{student_id}_" in k or f"{student_id}." in k or f"{student_id}_" in k:
-                ENCODING_CACHE.pop(k, None)
+    # clear encoding cache (lru_cache has no per-key eviction)
+    _face_encoding_cached.cache_clear()
+
+    # drop the student's rows from the in-memory gallery
+    load_known_encodings()
 
     return jsonify({"success": True, "message": "Deleted"})
 
@@ -578,12 +1094,13 @@ def api_mark_attendance():
             liveness_checked = True
             if not is_live:
                 return jsonify({"success": False, "message": "No motion detected — likely spoof (Option C)"}), 403
-            # build a PIL image from middle frame for face matching
-            mid = frames[len(frames)//2]
-            if "," in mid:
-                mid = mid.split(",", 1)[1]
-            img_bytes = base64.b64decode(mid)
-            pil_img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
+            # decode frames for matching: all of them if detection can run
+            # batched on GPU, otherwise just the middle frame
+            raw = [base64.b64decode(f.split(",", 1)[1] if "," in f else f) for f in frames]
+            if cuda_batch_detect_available():
+                pil_imgs = list(DECODE_POOL.map(lambda rb: open_image_bytes(rb).convert("RGB"), raw))
+            else:
+                pil_imgs = [open_image_bytes(raw[len(raw)//2]).convert("RGB")]
         except Exception as e:
             return jsonify({"success": False, "message": f"Motion/liveness check failed: {e}"}), 500
     elif image_single:
@@ -591,68 +1108,127 @@ def api_mark_attendance():
         try:
             b64 = image_single.split(",",1)[1] if "," in image_single else image_single
             img_bytes = base64.b64decode(b64)
-            pil_img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
+            pil_imgs = [open_image_bytes(img_bytes).convert("RGB")]
             liveness_checked = False
         except Exception as e:
             return jsonify({"success": False, "message": f"Failed to decode image: {e}"}), 400
     else:
         return jsonify({"success": False, "message": "Provide 'frames' (recommended) or 'image'"}), 400
 
-    # compute encodings for faces in submitted image
-    unknown_encs = compute_face_encodings_from_pil(pil_img)
+    return match_faces_and_mark(pil_imgs, liveness_checked)
+
+def match_faces_and_mark(pil_imgs, liveness_checked):
+    """
+    Encode faces in the probe frames, match them against the gallery and
+    insert attendance rows for accepted matches. Returns a flask response.
+    Shared by the JSON and multipart variants of mark_attendance.
+    """
+    # compute encodings for faces in submitted frames
+    unknown_encs = compute_face_encodings_from_frames(pil_imgs)
     if not unknown_encs:
         return jsonify({"success": True, "matched": [], "message": "No faces found"})
 
-    # load all photos from DB and compute / fetch encodings
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id, student_id, photo_path FROM photos")
-    photos = c.fetchall()
-    conn.close()
-
-    known_encodings = []
-    known_meta = []
-    for pid, sid, ppath in photos:
-        enc = compute_face_encoding_from_file(ppath)
-        if enc is not None:
-            known_encodings.append(enc)
-            known_meta.append((pid, sid, ppath))
+    # snapshot the precomputed gallery (loaded at startup / on enrollment)
+    with KNOWN_LOCK:
+        known_matrix = KNOWN_MATRIX
+        known_q = KNOWN_Q
+        known_scale = KNOWN_SCALE
+        known_index = KNOWN_INDEX
+        known_meta = list(KNOWN_META)
 
     matches = []
-    for unk in unknown_encs:
-        if len(known_encodings) == 0:
+    if known_matrix is None:
+        return jsonify({"success": True, "matched": [], "liveness_checked": liveness_checked})
+
+    # with both sides L2-normalized, ||k-u||^2 == 2 - 2*(k.u), so the best
+    # match is simply the largest dot product
+    U = normalize_rows(np.stack(unknown_encs).astype(np.float32))
+    if known_index is not None:
+        # faiss nearest-neighbor: sub-linear once the index is IVF-partitioned
+        S, I = known_index.search(np.ascontiguousarray(U), 1)
+        best_idxs = I[:, 0]
+        best_sims = S[:, 0]
+    else:
+        # one GEMM against the whole gallery instead of per-face distance loops
+        S = gallery_dot(known_matrix, known_q, known_scale, U)
+        best_idxs = S.argmax(0)
+        best_sims = S[best_idxs, np.arange(U.shape[0])]
+    best_dists = np.sqrt(np.maximum(2.0 - 2.0 * best_sims, 0.0))
+
+    conn = get_db()
+    c = conn.cursor()
+    attendance_rows = []
+    for i in range(U.shape[0]):
+        best_idx = int(best_idxs[i])
+        if best_idx < 0:
+            # IVF probe found nothing in the visited partitions
             continue
-        distances = face_recognition.face_distance(known_encodings, unk)
-        best_idx = int(np.argmin(distances))
-        best_distance = float(distances[best_idx])
+        best_distance = float(best_dists[i])
         # threshold (0.5 typical; tune as needed)
         if best_distance < 0.50:
             pid, sid, ppath = known_meta[best_idx]
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
             c.execute("SELECT name, roll_no FROM students WHERE student_id=?", (sid,))
             r = c.fetchone()
-            conn.close()
             name = r[0] if r else "Unknown"
             roll_no = r[1] if r else "-"
-            # insert attendance
             now = datetime.datetime.now()
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute("INSERT INTO attendance (student_id, date, time_in, status, created_at) VALUES (?, ?, ?, ?, ?)",
-                      (sid, now.strftime("%Y-%m-%d"), now.strftime("%H:%M:%S"), "present", now.isoformat()))
-            conn.commit()
-            conn.close()
-
+            # skip the insert if another request already marked this student today
+            if not already_marked_today(sid, now.strftime("%Y-%m-%d")):
+                attendance_rows.append((sid, now.strftime("%Y-%m-%d"), now.strftime("%H:%M:%S"), "present", now.isoformat()))
             matches.append({'student_id': sid, 'name': name, 'roll_no': roll_no, 'photo_path': ppath, 'distance': best_distance})
 
+    # single batched insert instead of one commit per match
+    if attendance_rows:
+        c.executemany("INSERT INTO attendance (student_id, date, time_in, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                      attendance_rows)
+        conn.commit()
+
     return jsonify({"success": True, "matched": matches, "liveness_checked": liveness_checked})
 
+@app.route("/api/mark_attendance_bin", methods=["POST"])
+def api_mark_attendance_bin():
+    """
+    multipart/form-data variant of /api/mark_attendance: raw PNG/JPEG files
+    under "frames" (2+ recommended, motion-checked) or a single file under
+    "image". Skips the base64 round-trip entirely, cutting request size by
+    ~25-30% and removing the per-frame b64decode.
+    """
+    if not FACE_LIB_AVAILABLE:
+        return jsonify({"success": False, "message": "face_recognition / numpy not available on server"}), 500
+
+    frame_files = request.files.getlist("frames")
+    image_file = request.files.get("image")
+
+    liveness_checked = False
+
+    if frame_files and len(frame_files) >= 2:
+        try:
+            raw_frames = [f.read() for f in frame_files]
+            gray_frames = list(DECODE_POOL.map(decode_gray_frame, raw_frames))
+            liveness_checked = True
+            if not gray_frames_have_motion(gray_frames):
+                return jsonify({"success": False, "message": "No motion detected — likely spoof (Option C)"}), 403
+            if cuda_batch_detect_available():
+                pil_imgs = list(DECODE_POOL.map(lambda rb: open_image_bytes(rb).convert("RGB"), raw_frames))
+            else:
+                pil_imgs = [open_image_bytes(raw_frames[len(raw_frames)//2]).convert("RGB")]
+        except Exception as e:
+            return jsonify({"success": False, "message": f"Motion/liveness check failed: {e}"}), 500
+    elif image_file:
+        try:
+            pil_imgs = [Image.open(image_file.stream).convert("RGB")]
+        except Exception as e:
+            return jsonify({"success": False, "message": f"Failed to decode image: {e}"}), 400
+    else:
+        return jsonify({"success": False, "message": "Provide 'frames' files (recommended) or 'image'"}), 400
+
+    return match_faces_and_mark(pil_imgs, liveness_checked)
+
 @app.route("/api/get_attendance", methods=["GET"])
 def api_get_attendance():
     today = datetime.datetime.now().strftime("%Y-%m-%d")
 
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     c = conn.cursor()
     c.execute("""
         SELECT a.id, a.student_id, s.name, s.roll_no,
@@ -663,7 +1239,6 @@ def api_get_attendance():
         ORDER BY a.time_in DESC
     """, (today,))
     rows = c.fetchall()
-    conn.close()
 
     records = []
     for r in rows:
@@ -682,30 +1257,28 @@ def api_get_attendance():
 
 @app.route("/export_csv")
 def export_csv():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-
-    c.execute("""
-        SELECT s.roll_no, s.name, a.date, a.time_in, a.status
-        FROM attendance a
-        LEFT JOIN students s ON a.student_id = s.student_id
-        ORDER BY a.date DESC, a.time_in DESC
-    """)
-    rows = c.fetchall()
-    conn.close()
-
-    output = io.StringIO()
-    writer = csv.writer(output)
-
-    # CSV Header
-    writer.writerow(["Roll No", "Name", "Date", "Time In", "Status"])
-
-    # CSV Rows
-    for row in rows:
-        writer.writerow(row)
+    def generate():
+        c = get_db().cursor()
+        # reuse one small StringIO per row instead of buffering the whole table
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+
+        writer.writerow(["Roll No", "Name", "Date", "Time In", "Status"])
+        yield buf.getvalue()
+
+        for row in c.execute("""
+            SELECT s.roll_no, s.name, a.date, a.time_in, a.status
+            FROM attendance a
+            LEFT JOIN students s ON a.student_id = s.student_id
+            ORDER BY a.date DESC, a.time_in DESC
+        """):
+            buf.seek(0)
+            buf.truncate()
+            writer.writerow(row)
+            yield buf.getvalue()
 
     response = Response(
-        output.getvalue(),
+        stream_with_context(generate()),
         mimetype="text/csv"
     )
     response.headers["Content-Disposition"] = "attachment; filename=attendance.csv"